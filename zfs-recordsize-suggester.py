@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
-import os
 import sys
 import math
+from bisect import bisect_left
+from collections import Counter
+
+from zfs_common import BUCKET_COLOR_MAP, GREEN, RESET, bucket_for_size, print_table, scan_tree_parallel
 
 def print_help():
     help_text = """
@@ -29,60 +32,22 @@ Notes:
 """
     print(help_text)
 
-def bucket_for_size(size):
-    if size < 1024:
-        return "<1K"
-    elif 1024 <= size < 2048:
-        return "1K–2K"
-    elif 2048 <= size < 4096:
-        return "2K–4K"
-    elif 4096 <= size < 8192:
-        return "4K–8K"
-    elif 8192 <= size < 16384:
-        return "8K–16K"
-    elif 16384 <= size < 32768:
-        return "16K–32K"
-    elif 32768 <= size < 65536:
-        return "32K–64K"
-    elif 65536 <= size < 131072:
-        return "64K–128K"
-    elif 131072 <= size < 262144:
-        return "128K–256K"
-    elif 262144 <= size < 524288:
-        return "256K–512K"
-    elif 524288 <= size < 1048576:
-        return "512K–1M"
-    elif 1048576 <= size < 2097152:
-        return "1M–2M"
-    elif 2097152 <= size < 4194304:
-        return "2M–4M"
-    elif 4194304 <= size < 8388608:
-        return "4M–8M"
-    elif 8388608 <= size < 16777216:
-        return "8M–16M"
-    else:
-        return ">16M"
+class SizeHistogram(Counter):
+    # Scan sink that counts files per distinct size; everything after the scan works from it.
+    def append(self, size):
+        self[size] += 1
+
+    # Merges another worker's histogram.
+    extend = Counter.update
 
 def scan_directory(directory):
-    counts = {}
-    total = 0
+    size_counts, dir_count = scan_tree_parallel(directory, SizeHistogram)
+    counts = Counter()
     total_size = 0
-    file_sizes = []
-    dir_count = 0
-    for root, dirs, files in os.walk(directory):
-        dir_count += len(dirs)
-        for file in files:
-            try:
-                path = os.path.join(root, file)
-                size = os.stat(path).st_size
-                total_size += size
-                file_sizes.append(size)
-                bucket = bucket_for_size(size)
-                counts[bucket] = counts.get(bucket, 0) + 1
-                total += 1
-            except Exception:
-                pass
-    return counts, total, total_size, file_sizes, dir_count
+    for size, n in size_counts.items():
+        counts[bucket_for_size(size)] += n
+        total_size += size * n
+    return counts, sum(size_counts.values()), total_size, size_counts, dir_count
 
 def human_readable_size(size, decimal_places=2):
     for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
@@ -98,56 +63,48 @@ def human_readable_size_base10(size, decimal_places=2):
         size /= 1000.0
     return f"{size:.{decimal_places}f} PB"
 
-def compute_median(sizes):
-    if not sizes:
+def compute_median(size_counts):
+    # Only the distinct sizes need sorting; walk them until the middle file(s).
+    n = sum(size_counts.values())
+    if n == 0:
         return 0
-    sizes_sorted = sorted(sizes)
-    n = len(sizes_sorted)
-    if n % 2 == 1:
-        return sizes_sorted[n//2]
-    else:
-        return (sizes_sorted[n//2 - 1] + sizes_sorted[n//2]) / 2
+    lower = None
+    seen = 0
+    for size in sorted(size_counts):
+        seen += size_counts[size]
+        if lower is None and seen > (n - 1) // 2:
+            lower = size
+        if seen > n // 2:
+            if n % 2 == 1:
+                return size
+            return (lower + size) / 2
+
+# Candidate recordsizes in ascending order.
+RECORDSIZE_BYTES = {
+    "8K": 8 * 1024,
+    "16K": 16 * 1024,
+    "32K": 32 * 1024,
+    "64K": 64 * 1024,
+    "128K": 128 * 1024,
+    "256K": 256 * 1024,
+    "512K": 512 * 1024,
+    "1M": 1024 * 1024,
+    "2M": 2 * 1024 * 1024,
+    "4M": 4 * 1024 * 1024,
+    "8M": 8 * 1024 * 1024,
+    "16M": 16 * 1024 * 1024,
+}
 
 def size_to_bytes(size_str):
-    mapping = {
-        "8K": 8 * 1024,
-        "16K": 16 * 1024,
-        "32K": 32 * 1024,
-        "64K": 64 * 1024,
-        "128K": 128 * 1024,
-        "256K": 256 * 1024,
-        "512K": 512 * 1024,
-        "1M": 1024 * 1024,
-        "2M": 2 * 1024 * 1024,
-        "4M": 4 * 1024 * 1024,
-        "8M": 8 * 1024 * 1024,
-        "16M": 16 * 1024 * 1024,
-    }
-    return mapping.get(size_str, 0)
+    return RECORDSIZE_BYTES.get(size_str, 0)
+
+# bytes_to_size rounds up to the next recordsize from 16K to 16M.
+ROUNDUP_SIZES = list(RECORDSIZE_BYTES)[1:]
+ROUNDUP_BYTES = [RECORDSIZE_BYTES[size] for size in ROUNDUP_SIZES]
 
 def bytes_to_size(rec_bytes):
-    if rec_bytes <= 16 * 1024:
-        return "16K"
-    elif rec_bytes <= 32 * 1024:
-        return "32K"
-    elif rec_bytes <= 64 * 1024:
-        return "64K"
-    elif rec_bytes <= 128 * 1024:
-        return "128K"
-    elif rec_bytes <= 256 * 1024:
-        return "256K"
-    elif rec_bytes <= 512 * 1024:
-        return "512K"
-    elif rec_bytes <= 1024 * 1024:
-        return "1M"
-    elif rec_bytes <= 2 * 1024 * 1024:
-        return "2M"
-    elif rec_bytes <= 4 * 1024 * 1024:
-        return "4M"
-    elif rec_bytes <= 8 * 1024 * 1024:
-        return "8M"
-    else:
-        return "16M"
+    i = bisect_left(ROUNDUP_BYTES, rec_bytes)
+    return ROUNDUP_SIZES[min(i, len(ROUNDUP_SIZES) - 1)]
 
 def simulate_zfs_allocation(file_size, candidate_bytes):
     if file_size == 0:
@@ -156,91 +113,69 @@ def simulate_zfs_allocation(file_size, candidate_bytes):
         blocks = (file_size + candidate_bytes - 1) // candidate_bytes
         return blocks * candidate_bytes
     else:
-        alloc = 512
-        while alloc < file_size and alloc < candidate_bytes:
-            alloc *= 2
-        return alloc
+        # Smallest power of two >= file_size, at least 512 B.
+        alloc = 1 << max(9, (file_size - 1).bit_length())
+        return min(alloc, candidate_bytes)
 
-def compute_waste(candidate_bytes, file_sizes):
-    total_waste = 0
-    total_allocated = 0
-    for s in file_sizes:
-        allocated = simulate_zfs_allocation(s, candidate_bytes)
-        total_waste += allocated - s
-        total_allocated += allocated
-    return total_waste, total_allocated
+def compute_waste(size_counts, candidate_bytes):
+    # Single pass over the distinct sizes, accumulating waste for every candidate at once.
+    # candidate_bytes must be ascending.
+    max_bytes = candidate_bytes[-1]
+    wastes = [0] * len(candidate_bytes)
+    # Waste of files that fit in one record, keyed by the smallest candidate that holds them.
+    fits = [0] * len(candidate_bytes)
+    for s, n in size_counts.items():
+        if s > max_bytes:
+            # Larger than every candidate, so each one allocates whole records.
+            for i, cb in enumerate(candidate_bytes):
+                wastes[i] += ((-s) % cb) * n
+            continue
+        first = bisect_left(candidate_bytes, s)
+        # A file that fits in a record gets the same power-of-two allocation
+        # for every candidate from first up, so record it once.
+        fits[first] += (simulate_zfs_allocation(s, max_bytes) - s) * n
+        for i in range(first):
+            wastes[i] += ((-s) % candidate_bytes[i]) * n
+    # Files that fit in one candidate's record also fit in every larger one.
+    running = 0
+    for i, waste in enumerate(fits):
+        running += waste
+        wastes[i] += running
+    return wastes
 
-def print_table(counts, total):
-    data = []
-    for bucket, count in counts.items():
-        perc = (count / total) * 100 if total > 0 else 0
-        data.append((bucket, count, perc))
-    data.sort(key=lambda x: x[2], reverse=True)
-    
-    col1 = 24  # Reduced "File Sizes" column width
-    col2 = 11
-    col3 = 11
-    
-    buckets_order = [
-        "<1K", "1K–2K", "2K–4K", "4K–8K", "8K–16K", "16K–32K",
-        "32K–64K", "64K–128K", "128K–256K", "256K–512K",
-        "512K–1M", "1M–2M", "2M–4M", "4M–8M", "8M–16M", ">16M"
-    ]
-    colors = [
-        "\033[31m", "\033[32m", "\033[33m", "\033[34m",
-        "\033[35m", "\033[36m", "\033[91m", "\033[92m",
-        "\033[93m", "\033[94m", "\033[95m", "\033[96m",
-        "\033[37m", "\033[90m", "\033[38;5;208m", "\033[38;5;141m"
-    ]
-    bucket_color_map = {bucket: colors[i % len(colors)] for i, bucket in enumerate(buckets_order)}
-    
-    reset = "\033[0m"
-    separator = f"+{'-'*(col1+2)}+{'-'*(col2+2)}+{'-'*(col3+2)}+"
-    header = f"| {'File Sizes'.ljust(col1)} | {'Files'.rjust(col2)} | {'Percent ↓'.rjust(col3)} |"
-    
-    print("\nFile Size Breakdown:")
-    print(separator)
-    print(header)
-    print(separator)
-    for bucket, count, perc in data:
-        perc_str = f"{perc:.2f}%".rjust(col3)
-        bucket_padded = bucket.ljust(col1)
-        bucket_color = bucket_color_map.get(bucket, "")
-        bucket_colored = f"{bucket_color}{bucket_padded}{reset}"
-        row = f"| {bucket_colored} | {str(count).rjust(col2)} | {perc_str} |"
-        print(row)
-    print(separator)
+# Recordsize candidate for each bucket: the bucket's upper limit, at least 8K.
+MODE_CANDIDATES = {
+    "<1K": "8K",
+    "1K–2K": "8K",
+    "2K–4K": "8K",
+    "4K–8K": "8K",
+    "8K–16K": "16K",
+    "16K–32K": "32K",
+    "32K–64K": "64K",
+    "64K–128K": "128K",
+    "128K–256K": "256K",
+    "256K–512K": "512K",
+    "512K–1M": "1M",
+    "1M–2M": "2M",
+    "2M–4M": "4M",
+    "4M–8M": "8M",
+    "8M–16M": "16M",
+    ">16M": "16M"
+}
 
 def compute_mode_candidate(counts, total):
-    mapping_mode = {
-        "<1K": "8K",
-        "1K–2K": "8K",
-        "2K–4K": "8K",
-        "4K–8K": "8K",
-        "8K–16K": "16K",
-        "16K–32K": "32K",
-        "32K–64K": "64K",
-        "64K–128K": "128K",
-        "128K–256K": "256K",
-        "256K–512K": "512K",
-        "512K–1M": "1M",
-        "1M–2M": "2M",
-        "2M–4M": "4M",
-        "4M–8M": "8M",
-        "8M–16M": "16M",
-        ">16M": "16M"
-    }
-    bucket_list = [(bucket, count) for bucket, count in counts.items()]
-    bucket_list.sort(key=lambda x: x[1], reverse=True)
+    # Accumulate buckets by frequency, tracking the largest candidate as we go.
     cumulative = 0
     selected = []
-    for bucket, count in bucket_list:
+    best_candidate = None
+    for bucket, count in sorted(counts.items(), key=lambda x: x[1], reverse=True):
         cumulative += count
-        candidate = mapping_mode.get(bucket, "128K")
+        candidate = MODE_CANDIDATES.get(bucket, "128K")
         selected.append((bucket, candidate, count))
+        if best_candidate is None or size_to_bytes(candidate) > size_to_bytes(best_candidate):
+            best_candidate = candidate
         if cumulative >= total * 0.5:
             break
-    best_candidate = max([cand for _, cand, _ in selected], key=lambda x: size_to_bytes(x))
     return best_candidate, selected
 
 def candidate_to_bucket(candidate):
@@ -253,14 +188,15 @@ def candidate_to_bucket(candidate):
     else:
         return candidate
 
-def compute_best_candidate(file_sizes):
-    candidates = ["8K", "16K", "32K", "64K", "128K", "256K", "512K", "1M", "2M", "4M", "8M", "16M"]
+def compute_best_candidate(size_counts):
     best = None
     best_overhead = float('inf')
     candidate_data = []
-    for candidate in candidates:
-        candidate_bytes = size_to_bytes(candidate)
-        waste, allocated = compute_waste(candidate_bytes, file_sizes)
+    # Simulate each distinct size once instead of every file.
+    wastes = compute_waste(size_counts, tuple(RECORDSIZE_BYTES.values()))
+    sizes_sum = sum(s * n for s, n in size_counts.items())
+    for candidate, waste in zip(RECORDSIZE_BYTES, wastes):
+        allocated = waste + sizes_sum
         overhead = (waste / allocated * 100) if allocated > 0 else float('inf')
         candidate_data.append((candidate, waste, overhead))
         if overhead < best_overhead:
@@ -268,46 +204,29 @@ def compute_best_candidate(file_sizes):
             best_overhead = overhead
     return best, best_overhead, candidate_data
 
-def print_waste_table(file_sizes, candidate_data):
+def print_waste_table(candidate_data):
     col1 = 10  # Candidate column width
     col2 = 20  # Total wasted column width
     col3 = 12  # Overhead column width
     separator = f"+{'-'*(col1+2)}+{'-'*(col2+2)}+{'-'*(col3+2)}+"
     header = f"| {'Candidate'.center(col1)} | {'Total Wasted'.center(col2)} | {'Overhead ↑'.center(col3)} |"
     
-    buckets_order = [
-        "<1K", "1K–2K", "2K–4K", "4K–8K", "8K–16K", "16K–32K",
-        "32K–64K", "64K–128K", "128K–256K", "256K–512K",
-        "512K–1M", "1M–2M", "2M–4M", "4M–8M", "8M–16M", ">16M"
-    ]
-    colors = [
-        "\033[31m", "\033[32m", "\033[33m", "\033[34m",
-        "\033[35m", "\033[36m", "\033[91m", "\033[92m",
-        "\033[93m", "\033[94m", "\033[95m", "\033[96m",
-        "\033[37m", "\033[90m", "\033[38;5;208m", "\033[38;5;141m"
-    ]
-    bucket_color_map = {bucket: colors[i % len(colors)] for i, bucket in enumerate(buckets_order)}
-    reset = "\033[0m"
-    
-    print("\nWasted Space Analysis:")
-    print(separator)
-    print(header)
-    print(separator)
+    lines = ["\nWasted Space Analysis:", separator, header, separator]
     min_overhead = min(candidate_data, key=lambda x: x[2])[2] if candidate_data else None
     for candidate, waste, overhead in candidate_data:
         candidate_bucket = candidate_to_bucket(candidate)
-        candidate_color = bucket_color_map.get(candidate_bucket, "")
-        candidate_colored = f"{candidate_color}{candidate.center(col1)}{reset}"
+        candidate_color = BUCKET_COLOR_MAP.get(candidate_bucket, "")
+        candidate_colored = f"{candidate_color}{candidate.center(col1)}{RESET}"
         waste_hr = human_readable_size(waste)
         overhead_str = f"{overhead:.2f}%".rjust(col3)
         if math.isclose(overhead, min_overhead, rel_tol=1e-6):
-            overhead_str = f"\033[32m{overhead_str}{reset}"
+            overhead_str = f"{GREEN}{overhead_str}{RESET}"
         row = f"| {candidate_colored} | {waste_hr.center(col2)} | {overhead_str} |"
-        print(row)
-    print(separator)
+        lines.append(row)
+    lines.append(separator)
+    sys.stdout.write("\n".join(lines) + "\n")
 
-def compute_final_recommendation(counts, candidate_data):
-    mode_candidate, mode_details = compute_mode_candidate(counts, total_files)
+def compute_final_recommendation(mode_candidate, mode_details, candidate_data):
     print("\nMode Candidate Details (Buckets considered until reaching 50% of files):")
     cumulative = 0
     for bucket, candidate, count in mode_details:
@@ -319,28 +238,23 @@ def compute_final_recommendation(counts, candidate_data):
     final_bytes = max(size_to_bytes(mode_candidate), size_to_bytes(best_candidate))
     return bytes_to_size(final_bytes), mode_candidate, best_candidate
 
-# Global variable for total file count.
-total_files = 0
-
 def main():
-    global total_files
     if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
         print_help()
         sys.exit(0)
     directory = sys.argv[1]
     print(f"Scanning directory: {directory}\n")
-    counts, total, total_size, file_sizes, dir_count = scan_directory(directory)
-    total_files = total
+    counts, total, total_size, size_counts, dir_count = scan_directory(directory)
     if total == 0:
         print("No files found.")
     else:
-        print_table(counts, total)
-        best_candidate, best_overhead, candidate_data = compute_best_candidate(file_sizes)
-        print_waste_table(file_sizes, candidate_data)
-        mode_candidate, _ = compute_mode_candidate(counts, total)
-        final_rec, mode_rec, waste_rec = compute_final_recommendation(counts, candidate_data)
+        print_table(counts, total, "File Sizes", 24, "Percent ↓", title="\nFile Size Breakdown:")
+        best_candidate, best_overhead, candidate_data = compute_best_candidate(size_counts)
+        print_waste_table(candidate_data)
+        mode_candidate, mode_details = compute_mode_candidate(counts, total)
+        final_rec, mode_rec, waste_rec = compute_final_recommendation(mode_candidate, mode_details, candidate_data)
         avg = total_size / total
-        median = compute_median(file_sizes)
+        median = compute_median(size_counts)
         hr_avg = human_readable_size(avg)
         hr_med = human_readable_size(median)
         hr_total_base2 = human_readable_size(total_size)
@@ -361,9 +275,9 @@ def main():
         box_width = 40
         rec_text = f" {final_rec} "
         box_line = "+" + "-"*(box_width-2) + "+"
-        print("\033[32m" + box_line)
+        print(GREEN + box_line)
         print("|" + rec_text.center(box_width-2) + "|")
-        print(box_line + "\033[0m")
+        print(box_line + RESET)
         print("\nExplanation:")
         print("  - Mode candidate: determined by accumulating buckets (sorted by frequency) until reaching 50% of files,")
         print("    then choosing the candidate (upper limit) of the highest bucket in that selection.")
@@ -0,0 +1,172 @@
+# Shared scanning, bucketing and table code for zfs-recordsize-suggester.py and size-dist-simple.py.
+# Fully typed so it can be compiled with mypyc (mypyc zfs_common.py); the ctypes statx
+# code lives in zfs_statx.py, which mypyc cannot compile and stays interpreted.
+import os
+import sys
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Mapping, Optional, Protocol, Tuple
+
+from zfs_statx import statx_reader
+
+# Bucket labels indexed by size.bit_length() - 10; every bucket spans a power of two.
+BUCKETS = (
+    "<1K", "1K–2K", "2K–4K", "4K–8K", "8K–16K", "16K–32K",
+    "32K–64K", "64K–128K", "128K–256K", "256K–512K",
+    "512K–1M", "1M–2M", "2M–4M", "4M–8M", "8M–16M", ">16M"
+)
+
+# ANSI color codes, one per bucket (cycled if there are more buckets than colors).
+COLORS = (
+    "\033[31m",  # Red
+    "\033[32m",  # Green
+    "\033[33m",  # Yellow
+    "\033[34m",  # Blue
+    "\033[35m",  # Magenta
+    "\033[36m",  # Cyan
+    "\033[91m",  # Bright Red
+    "\033[92m",  # Bright Green
+    "\033[93m",  # Bright Yellow
+    "\033[94m",  # Bright Blue
+    "\033[95m",  # Bright Magenta
+    "\033[96m",  # Bright Cyan
+    "\033[37m",  # White
+    "\033[90m",  # Gray
+    "\033[38;5;208m",  # Orange (if supported)
+    "\033[38;5;141m",  # Violet (if supported)
+)
+
+# Bucket label -> color code, so each bucket keeps the same color in every table.
+BUCKET_COLOR_MAP = {bucket: COLORS[i % len(COLORS)] for i, bucket in enumerate(BUCKETS)}
+
+GREEN = "\033[32m"
+RESET = "\033[0m"
+
+def bucket_for_size(size: int) -> str:
+    # Sizes below 1K (including 0) clamp to the first bucket, 16M and up to the last.
+    return BUCKETS[max(0, min(15, size.bit_length() - 10))]
+
+class SizeSink(Protocol):
+    # Where a scan puts file sizes: array('q') keeps them all, a tally can just count them.
+    # extend() merges another sink of the same kind (one per worker thread).
+    def append(self, __size: int) -> None: ...
+    def extend(self, __other: Any) -> None: ...
+
+def size_array() -> "array[int]":
+    # Default sink: sizes kept as packed 64-bit ints, not a list of int objects.
+    return array('q')
+
+# os.scandir(fd) is POSIX-only; elsewhere (Windows) directories are scanned by path.
+SCANDIR_FD = os.scandir in os.supports_fd
+
+def _open_dir(path: str, follow_symlinks: bool = False) -> int:
+    # Directory fd for statx and scandir: never inherited by children, never blocks,
+    # and (unless asked) refuses a directory swapped for a symlink after listing.
+    flags = (os.O_RDONLY | getattr(os, "O_DIRECTORY", 0) | getattr(os, "O_CLOEXEC", 0)
+             | getattr(os, "O_NONBLOCK", 0))
+    if not follow_symlinks:
+        flags |= getattr(os, "O_NOFOLLOW", 0)
+    return os.open(path, flags)
+
+def _scan_entries(it: Iterator["os.DirEntry[str]"], path: str, dirfd: Optional[int],
+                  sink: SizeSink, subdirs: List[str],
+                  statx_size: Optional[Callable[[int, str], int]]) -> None:
+    for entry in it:
+        if entry.is_dir(follow_symlinks=False):
+            subdirs.append(os.path.join(path, entry.name))
+        elif entry.is_file(follow_symlinks=False):
+            try:
+                if statx_size is not None and dirfd is not None:
+                    size = statx_size(dirfd, entry.name)
+                else:
+                    size = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+            sink.append(size)
+
+def scan_dir(path: str, sink: SizeSink, subdirs: List[str],
+             statx_size: Optional[Callable[[int, str], int]] = None, follow_symlinks: bool = False) -> None:
+    # Append sizes of regular files in path to sink and its subdirectories to subdirs.
+    if not SCANDIR_FD:
+        try:
+            it = os.scandir(path)
+        except OSError:
+            return
+        with it:
+            _scan_entries(it, path, None, sink, subdirs, None)
+        return
+    try:
+        dirfd = _open_dir(path, follow_symlinks)
+    except OSError:
+        return
+    try:
+        with os.scandir(dirfd) as it:
+            _scan_entries(it, path, dirfd, sink, subdirs, statx_size)
+    finally:
+        os.close(dirfd)
+
+def scan_tree(directory: str, new_sink: Callable[[], SizeSink] = size_array) -> Tuple[SizeSink, int]:
+    # Returns a sink filled with the file sizes under directory and the number of directories below it.
+    sink = new_sink()
+    statx_size = statx_reader()
+    dir_count = -1
+    pending = [directory]
+    while pending:
+        dir_count += 1
+        scan_dir(pending.pop(), sink, pending, statx_size)
+    return sink, dir_count
+
+# Scan top-level subdirectories in parallel once there are at least this many.
+PARALLEL_MIN_SUBDIRS = 8
+
+def scan_tree_parallel(directory: str, new_sink: Callable[[], SizeSink] = size_array) -> Tuple[SizeSink, int]:
+    # os.scandir and stat release the GIL, so subtrees can be walked in threads.
+    # Each worker fills its own sink; they are merged with extend() at the end.
+    sink = new_sink()
+    subdirs: List[str] = []
+    # The directory given on the command line may itself be a symlink.
+    scan_dir(directory, sink, subdirs, statx_reader(), follow_symlinks=True)
+    dir_count = len(subdirs)
+    cpus = os.cpu_count() or 1
+    results: Iterable[Tuple[SizeSink, int]]
+    # With a single CPU the threads only add GIL hand-offs, so walk serially.
+    if len(subdirs) < PARALLEL_MIN_SUBDIRS or cpus < 2:
+        results = (scan_tree(subdir, new_sink) for subdir in subdirs)
+    else:
+        with ThreadPoolExecutor(max_workers=cpus * 2) as pool:
+            results = list(pool.map(scan_tree, subdirs, [new_sink] * len(subdirs)))
+    for worker_sink, count in results:
+        sink.extend(worker_sink)
+        dir_count += count
+    return sink, dir_count
+
+def print_table(counts: Mapping[str, int], total: int, label: str, width: int,
+                percent_label: str, title: Optional[str] = None) -> None:
+    # Build data as a list of tuples: (bucket, count, percentage), by percentage descending.
+    data = []
+    for bucket, count in counts.items():
+        perc = (count / total) * 100 if total > 0 else 0
+        data.append((bucket, count, perc))
+    data.sort(key=lambda x: x[2], reverse=True)
+
+    col1 = width  # Bucket column width
+    col2 = 11  # Files column width
+    col3 = 11  # Percent column width (includes "%" symbol)
+
+    separator = f"+{'-' * (col1 + 2)}+{'-' * (col2 + 2)}+{'-' * (col3 + 2)}+"
+    header = f"| {label.ljust(col1)} | {'Files'.rjust(col2)} | {percent_label.rjust(col3)} |"
+
+    lines = [separator, header, separator]
+    if title is not None:
+        lines.insert(0, title)
+    for bucket, count, perc in data:
+        perc_str = f"{perc:.2f}%".rjust(col3)
+        bucket_padded = bucket.ljust(col1)
+        # Get the color for this bucket; default to no color if not defined.
+        bucket_color = BUCKET_COLOR_MAP.get(bucket, "")
+        bucket_colored = f"{bucket_color}{bucket_padded}{RESET}"
+        row = f"| {bucket_colored} | {str(count).rjust(col2)} | {perc_str} |"
+        lines.append(row)
+    lines.append(separator)
+    # Write the whole table at once instead of one print per row.
+    sys.stdout.write("\n".join(lines) + "\n")
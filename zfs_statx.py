@@ -0,0 +1,71 @@
+# Optional statx(2) size lookups for zfs_common's directory scan (Linux only).
+# Kept out of zfs_common.py because mypyc cannot compile ctypes.Structure subclasses.
+import ctypes
+import os
+from typing import Any, Callable, Optional
+
+# statx(2) constants from <fcntl.h> and <linux/stat.h>.
+AT_FDCWD = -100
+AT_SYMLINK_NOFOLLOW = 0x100
+AT_STATX_DONT_SYNC = 0x4000
+STATX_SIZE = 0x200
+
+class _Statx(ctypes.Structure):
+    _fields_ = [
+        ("stx_mask", ctypes.c_uint32),
+        ("stx_blksize", ctypes.c_uint32),
+        ("stx_attributes", ctypes.c_uint64),
+        ("stx_nlink", ctypes.c_uint32),
+        ("stx_uid", ctypes.c_uint32),
+        ("stx_gid", ctypes.c_uint32),
+        ("stx_mode", ctypes.c_uint16),
+        ("stx_spare0", ctypes.c_uint16),
+        ("stx_ino", ctypes.c_uint64),
+        ("stx_size", ctypes.c_uint64),
+        ("stx_rest", ctypes.c_uint8 * 208),  # Remainder of the 256-byte struct.
+    ]
+
+# libc statx() function; None until first looked up, False if unusable.
+_statx: Any = None
+
+def _load_statx() -> Any:
+    global _statx
+    if _statx is None:
+        try:
+            # CDLL(None) raises TypeError on Windows.
+            func = ctypes.CDLL(None, use_errno=True).statx
+        except (OSError, AttributeError, TypeError):
+            _statx = False
+            return _statx
+        func.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int,
+                         ctypes.c_uint, ctypes.POINTER(_Statx)]
+        func.restype = ctypes.c_int
+        # glibc may export statx on kernels that lack it (ENOSYS).
+        ok = func(AT_FDCWD, b".", AT_STATX_DONT_SYNC, STATX_SIZE, ctypes.byref(_Statx())) == 0
+        # Assign once, fully probed, since scan threads may race here.
+        _statx = func if ok else False
+    return _statx
+
+# statx is opt-in: through ctypes it costs more per file than os.stat, and only pays off
+# where AT_STATX_DONT_SYNC avoids a round trip (network or FUSE mounts).
+USE_STATX = os.environ.get("ZFS_RECORDSIZE_STATX") == "1"
+
+def statx_reader() -> Optional[Callable[[int, str], int]]:
+    # Returns size(dirfd, name) backed by one reusable statx buffer, or None to use
+    # DirEntry.stat(). Create one per scan_tree call; the buffer is not thread-safe.
+    if not USE_STATX:
+        return None
+    statx = _load_statx()
+    if not statx:
+        return None
+    buf = _Statx()
+    buf_ref = ctypes.byref(buf)
+    flags = AT_SYMLINK_NOFOLLOW | AT_STATX_DONT_SYNC
+
+    def statx_size(dirfd: int, name: str) -> int:
+        if statx(dirfd, os.fsencode(name), flags, STATX_SIZE, buf_ref) != 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), name)
+        return int(buf.stx_size)
+
+    return statx_size